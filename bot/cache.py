@@ -0,0 +1,35 @@
+import time
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: Dict[K, Tuple[float, V]] = {}
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.maxsize:
+            del self._entries[next(iter(self._entries))]
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+
+    def pop(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-from typing import Sequence
 import os
 
 
@@ -7,24 +6,27 @@ import os
 class Settings:
     bot_token: str
     channel_username: str
-    admin_ids: Sequence[int]
+    admin_ids: frozenset[int]
     min_withdrawal: int = 15
     start_bonus: int = 3
     referral_bonus: int = 3
     daily_bonus: int = 1
+    db_read_connections: int = 4
 
 
 def load_settings() -> Settings:
     token = os.getenv("BOT_TOKEN", "PLACE-YOUR-TOKEN-HERE")
     channel = os.getenv("CHANNEL_USERNAME", "@example_channel")
     raw_admins = os.getenv("ADMIN_IDS", "")
-    admin_ids = tuple(
+    admin_ids = frozenset(
         int(admin_id.strip())
         for admin_id in raw_admins.split(",")
         if admin_id.strip().isdigit()
     )
+    raw_readers = os.getenv("DB_READ_CONNECTIONS", "").strip()
     return Settings(
         bot_token=token,
         channel_username=channel,
-        admin_ids=admin_ids or (123456789,),
+        admin_ids=admin_ids or frozenset({123456789}),
+        db_read_connections=max(int(raw_readers), 1) if raw_readers.isdecimal() else 4,
     )
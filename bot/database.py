@@ -2,12 +2,29 @@ from __future__ import annotations
 
 import asyncio
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Iterable, Optional
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, TypeVar
+
+from .cache import TTLCache
 
 _DB_PATH = Path("bot_data.sqlite3")
+_USER_FIELDS = (
+    "telegram_id",
+    "balance",
+    "referred_by",
+    "is_subscribed",
+    "reward_claimed",
+    "last_daily_bonus_ts",
+    "username",
+    "is_banned",
+    "start_bonus_claimed",
+)
+_USER_COLUMNS = ", ".join(_USER_FIELDS)
+
+T = TypeVar("T")
 
 
 @dataclass(slots=True)
@@ -15,12 +32,12 @@ class User:
     telegram_id: int
     balance: int
     referred_by: Optional[int]
-    is_subscribed: bool
-    reward_claimed: bool
-    last_daily_bonus: Optional[str]
+    is_subscribed: int
+    reward_claimed: int
+    last_daily_bonus_ts: Optional[int]
     username: Optional[str]
-    is_banned: bool
-    start_bonus_claimed: bool
+    is_banned: int
+    start_bonus_claimed: int
 
 
 @dataclass(slots=True)
@@ -33,12 +50,21 @@ class WithdrawalRequest:
 
 
 class Database:
-    def __init__(self, path: Path | str = _DB_PATH) -> None:
+    def __init__(
+        self,
+        path: Path | str = _DB_PATH,
+        user_cache_size: int = 50_000,
+        user_cache_ttl: float = 60,
+    ) -> None:
         self._path = Path(path)
-        self._lock = asyncio.Lock()
-
-    async def setup(self) -> None:
-        await self._execute(
+        self._writer_lock = asyncio.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._conn: sqlite3.Connection | None = None
+        self._readers: Optional[asyncio.Queue[sqlite3.Connection]] = None
+        self._user_cache: TTLCache[int, User] = TTLCache(user_cache_size, user_cache_ttl)
+
+    async def setup(self, read_connections: int = 4) -> None:
+        await self._executescript(
             """
             CREATE TABLE IF NOT EXISTS users (
                 telegram_id INTEGER PRIMARY KEY,
@@ -50,17 +76,6 @@ class Database:
                 username TEXT,
                 is_banned INTEGER NOT NULL DEFAULT 0
             );
-            """
-        )
-        await self._ensure_column("users", "username", "TEXT")
-        await self._ensure_column("users", "is_banned", "INTEGER NOT NULL DEFAULT 0")
-        await self._ensure_column(
-            "users",
-            "start_bonus_claimed",
-            "INTEGER NOT NULL DEFAULT 1",
-        )
-        await self._execute(
-            """
             CREATE TABLE IF NOT EXISTS withdrawals (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 telegram_id INTEGER NOT NULL,
@@ -68,78 +83,113 @@ class Database:
                 status TEXT NOT NULL DEFAULT 'pending',
                 created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
             );
+            CREATE INDEX IF NOT EXISTS idx_users_referred_by
+            ON users(referred_by) WHERE referred_by IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS idx_withdrawals_status_created
+            ON withdrawals(status, created_at DESC);
+            """
+        )
+        migrations = await self._column_migrations(
+            "users",
+            (
+                ("username", "TEXT"),
+                ("is_banned", "INTEGER NOT NULL DEFAULT 0"),
+                ("start_bonus_claimed", "INTEGER NOT NULL DEFAULT 1"),
+                ("last_daily_bonus_ts", "INTEGER"),
+            ),
+        )
+        await self._executescript(
+            migrations
+            + """
+            UPDATE users
+            SET last_daily_bonus_ts = CAST(strftime('%s', last_daily_bonus) AS INTEGER)
+            WHERE last_daily_bonus_ts IS NULL AND last_daily_bonus IS NOT NULL;
             """
         )
+        self._open_readers(read_connections)
+
+    def invalidate(self, telegram_id: int) -> None:
+        self._user_cache.pop(telegram_id)
 
     async def get_user(self, telegram_id: int) -> Optional[User]:
+        cached = self._user_cache.get(telegram_id)
+        if cached is not None:
+            return replace(cached)
         row = await self._fetchone(
-            "SELECT telegram_id, balance, referred_by, is_subscribed, reward_claimed, last_daily_bonus, username, is_banned, start_bonus_claimed FROM users WHERE telegram_id = ?",
+            f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = ?",
             (telegram_id,),
         )
         if row is None:
             return None
-        return User(
-            telegram_id=row[0],
-            balance=row[1],
-            referred_by=row[2],
-            is_subscribed=bool(row[3]),
-            reward_claimed=bool(row[4]),
-            last_daily_bonus=row[5],
-            username=row[6],
-            is_banned=bool(row[7]),
-            start_bonus_claimed=bool(row[8]),
+        return self._remember(User(**row))
+
+    async def get_access_flags(self, telegram_id: int) -> Optional[tuple[bool, bool]]:
+        cached = self._user_cache.get(telegram_id)
+        if cached is not None:
+            return bool(cached.is_banned), bool(cached.is_subscribed)
+        row = await self._fetchone(
+            "SELECT is_banned, is_subscribed FROM users WHERE telegram_id = ?",
+            (telegram_id,),
         )
+        if row is None:
+            return None
+        return bool(row["is_banned"]), bool(row["is_subscribed"])
 
-    async def create_user(
+    async def upsert_and_get_user(
         self,
         telegram_id: int,
         initial_balance: int,
         referred_by: Optional[int],
         username: Optional[str],
-    ) -> None:
-        await self._execute(
-            """
-            INSERT OR IGNORE INTO users (
-                telegram_id,
-                balance,
-                referred_by,
-                username,
-                start_bonus_claimed
-            )
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                telegram_id,
-                initial_balance,
-                referred_by,
-                username,
-                int(initial_balance > 0),
-            ),
-        )
-
-    async def assign_referrer(self, telegram_id: int, referred_by: Optional[int]) -> None:
-        await self._execute(
-            "UPDATE users SET referred_by = ? WHERE telegram_id = ? AND referred_by IS NULL",
-            (referred_by, telegram_id),
-        )
-
-    async def update_username(self, telegram_id: int, username: Optional[str]) -> None:
-        await self._execute(
-            "UPDATE users SET username = ? WHERE telegram_id = ?",
-            (username, telegram_id),
-        )
+    ) -> tuple[User, bool]:
+        if referred_by == telegram_id:
+            referred_by = None
+        existing = await self.get_user(telegram_id)
+        if (
+            existing is not None
+            and existing.username == username
+            and not (referred_by and existing.referred_by is None)
+        ):
+            return existing, False
+
+        def upsert(conn: sqlite3.Connection) -> tuple[User, bool]:
+            row = conn.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = ?",
+                (telegram_id,),
+            ).fetchone()
+            if row is None:
+                user = _insert_user(conn, telegram_id, initial_balance, referred_by, username)
+                return user, True
+            if row["username"] != username or (
+                referred_by and row["referred_by"] is None
+            ):
+                row = conn.execute(
+                    f"""
+                    UPDATE users
+                    SET username = ?, referred_by = COALESCE(referred_by, ?)
+                    WHERE telegram_id = ?
+                    RETURNING {_USER_COLUMNS}
+                    """,
+                    (username, referred_by, telegram_id),
+                ).fetchone()
+            return User(**row), False
+
+        user, created = await self._write(upsert, transaction=True)
+        return self._remember(user), created
 
     async def update_balance(self, telegram_id: int, delta: int) -> None:
         await self._execute(
             "UPDATE users SET balance = balance + ? WHERE telegram_id = ?",
             (delta, telegram_id),
         )
+        self.invalidate(telegram_id)
 
     async def set_subscription(self, telegram_id: int, subscribed: bool) -> None:
         await self._execute(
             "UPDATE users SET is_subscribed = ? WHERE telegram_id = ?",
             (int(subscribed), telegram_id),
         )
+        self.invalidate(telegram_id)
 
     async def mark_reward_claimed(self, telegram_id: int) -> None:
         await self.set_reward_claimed(telegram_id, True)
@@ -149,18 +199,21 @@ class Database:
             "UPDATE users SET reward_claimed = ? WHERE telegram_id = ?",
             (int(claimed), telegram_id),
         )
+        self.invalidate(telegram_id)
 
     async def set_start_bonus_claimed(self, telegram_id: int, claimed: bool) -> None:
         await self._execute(
             "UPDATE users SET start_bonus_claimed = ? WHERE telegram_id = ?",
             (int(claimed), telegram_id),
         )
+        self.invalidate(telegram_id)
 
-    async def set_last_daily_bonus(self, telegram_id: int, timestamp: str | None) -> None:
+    async def set_last_daily_bonus(self, telegram_id: int, timestamp: int | None) -> None:
         await self._execute(
-            "UPDATE users SET last_daily_bonus = ? WHERE telegram_id = ?",
+            "UPDATE users SET last_daily_bonus_ts = ? WHERE telegram_id = ?",
             (timestamp, telegram_id),
         )
+        self.invalidate(telegram_id)
 
     async def list_top_referrers(self, limit: int = 10) -> list[tuple[int, int]]:
         rows = await self._fetchall(
@@ -176,11 +229,24 @@ class Database:
         )
         return [(row[0], row[1]) for row in rows if row[0] is not None]
 
-    async def add_withdrawal(self, telegram_id: int, amount: int) -> None:
-        await self._execute(
-            "INSERT INTO withdrawals (telegram_id, amount) VALUES (?, ?)",
-            (telegram_id, amount),
-        )
+    async def create_withdrawal(self, telegram_id: int, amount: int) -> bool:
+        def debit(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute(
+                "UPDATE users SET balance = balance - ? WHERE telegram_id = ? AND balance >= ?",
+                (amount, telegram_id, amount),
+            )
+            if cursor.rowcount == 0:
+                return False
+            conn.execute(
+                "INSERT INTO withdrawals (telegram_id, amount) VALUES (?, ?)",
+                (telegram_id, amount),
+            )
+            return True
+
+        debited = await self._write(debit, transaction=True)
+        if debited:
+            self.invalidate(telegram_id)
+        return debited
 
     async def list_referrals(self, telegram_id: int) -> list[tuple[int, Optional[str]]]:
         rows = await self._fetchall(
@@ -189,21 +255,44 @@ class Database:
         )
         return [(row[0], row[1]) for row in rows]
 
-    async def list_withdrawals(self, status: Optional[str] = None) -> list[WithdrawalRequest]:
-        if status:
-            query = "SELECT id, telegram_id, amount, status, created_at FROM withdrawals WHERE status = ? ORDER BY created_at DESC"
-            params: Iterable[Any] = (status,)
-        else:
-            query = "SELECT id, telegram_id, amount, status, created_at FROM withdrawals ORDER BY created_at DESC"
-            params = ()
-        rows = await self._fetchall(query, params)
+    async def list_pending_withdrawals_with_context(
+        self,
+    ) -> list[tuple[WithdrawalRequest, Optional[User], list[tuple[int, Optional[str]]]]]:
+        user_columns = ", ".join(f"u.{name}" for name in _USER_FIELDS)
+
+        def fetch(conn: sqlite3.Connection) -> tuple[list[sqlite3.Row], list[sqlite3.Row]]:
+            rows = conn.execute(
+                f"""
+                SELECT w.id, w.telegram_id, w.amount, w.status, w.created_at, {user_columns}
+                FROM withdrawals w
+                LEFT JOIN users u ON u.telegram_id = w.telegram_id
+                WHERE w.status = 'pending'
+                ORDER BY w.created_at DESC
+                """
+            ).fetchall()
+            referral_rows = conn.execute(
+                """
+                SELECT referred_by, telegram_id, username
+                FROM users
+                WHERE referred_by IN (
+                    SELECT telegram_id FROM withdrawals WHERE status = 'pending'
+                )
+                ORDER BY telegram_id
+                """
+            ).fetchall()
+            return rows, referral_rows
+
+        async with self._read_connection() as conn:
+            rows, referral_rows = await asyncio.to_thread(fetch, conn)
+
+        referrals: dict[int, list[tuple[int, Optional[str]]]] = {}
+        for referrer_id, telegram_id, username in referral_rows:
+            referrals.setdefault(referrer_id, []).append((telegram_id, username))
         return [
-            WithdrawalRequest(
-                id=row[0],
-                telegram_id=row[1],
-                amount=row[2],
-                status=row[3],
-                created_at=row[4],
+            (
+                WithdrawalRequest(*row[:5]),
+                User(**dict(zip(_USER_FIELDS, row[5:]))) if row[5] is not None else None,
+                referrals.get(row[1], []),
             )
             for row in rows
         ]
@@ -215,13 +304,7 @@ class Database:
         )
         if row is None:
             return None
-        return WithdrawalRequest(
-            id=row[0],
-            telegram_id=row[1],
-            amount=row[2],
-            status=row[3],
-            created_at=row[4],
-        )
+        return WithdrawalRequest(**row)
 
     async def set_withdrawal_status(self, request_id: int, status: str) -> None:
         await self._execute(
@@ -230,76 +313,240 @@ class Database:
         )
 
     async def list_all_users(self) -> list[User]:
+        return [user async for user in self.iter_all_users()]
+
+    async def iter_all_users(self, batch_size: int = 256) -> AsyncIterator[User]:
+        last_id: Optional[int] = None
+        while True:
+            if last_id is None:
+                rows = await self._fetchall(
+                    f"SELECT {_USER_COLUMNS} FROM users ORDER BY telegram_id LIMIT ?",
+                    (batch_size,),
+                )
+            else:
+                rows = await self._fetchall(
+                    f"""
+                    SELECT {_USER_COLUMNS} FROM users
+                    WHERE telegram_id > ?
+                    ORDER BY telegram_id
+                    LIMIT ?
+                    """,
+                    (last_id, batch_size),
+                )
+            for row in rows:
+                yield User(**row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]["telegram_id"]
+
+    async def sample_subscribed_users(self, limit: int) -> list[User]:
         rows = await self._fetchall(
-            """
-            SELECT telegram_id, balance, referred_by, is_subscribed, reward_claimed, last_daily_bonus, username, is_banned
+            f"""
+            SELECT {_USER_COLUMNS}
             FROM users
-            ORDER BY telegram_id
+            WHERE is_subscribed = 1 AND is_banned = 0
+            ORDER BY RANDOM()
+            LIMIT ?
             """,
+            (limit,),
         )
-        return [
-            User(
-                telegram_id=row[0],
-                balance=row[1],
-                referred_by=row[2],
-                is_subscribed=bool(row[3]),
-                reward_claimed=bool(row[4]),
-                last_daily_bonus=row[5],
-                username=row[6],
-                is_banned=bool(row[7]),
-            )
-            for row in rows
-        ]
-
-    async def set_ban_status(self, telegram_id: int, banned: bool) -> None:
-        await self._execute(
-            "UPDATE users SET is_banned = ? WHERE telegram_id = ?",
-            (int(banned), telegram_id),
-        )
+        return [User(**row) for row in rows]
+
+    async def set_ban_status_returning(
+        self, telegram_id: int, banned: bool
+    ) -> tuple[Optional[User], bool]:
+        def update(conn: sqlite3.Connection) -> tuple[Optional[User], bool]:
+            row = conn.execute(
+                f"""
+                UPDATE users SET is_banned = ?
+                WHERE telegram_id = ? AND is_banned != ?
+                RETURNING {_USER_COLUMNS}
+                """,
+                (int(banned), telegram_id, int(banned)),
+            ).fetchone()
+            if row is not None:
+                return User(**row), True
+            row = conn.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = ?",
+                (telegram_id,),
+            ).fetchone()
+            return (User(**row) if row is not None else None), False
+
+        user, changed = await self._write(update)
+        return (self._remember(user) if user is not None else None), changed
 
     async def count_users(self) -> int:
-        row = await self._fetchone("SELECT COUNT(*) FROM users")
-        return int(row[0]) if row else 0
+        rows = await self._fetchall("SELECT COUNT(*) FROM users")
+        return int(rows[0][0])
 
     async def sum_balances(self) -> int:
-        row = await self._fetchone("SELECT COALESCE(SUM(balance), 0) FROM users")
-        return int(row[0]) if row else 0
+        rows = await self._fetchall("SELECT COALESCE(SUM(balance), 0) FROM users")
+        return int(rows[0][0])
+
+    async def close(self) -> None:
+        self._user_cache.clear()
+        if self._readers is not None:
+            readers, self._readers = self._readers, None
+            while not readers.empty():
+                readers.get_nowait().close()
+        async with self._writer_lock:
+            if self._conn is not None:
+                await asyncio.get_running_loop().run_in_executor(self._writer, self._conn.close)
+                self._conn = None
+
+    def _remember(self, user: User) -> User:
+        self._user_cache.set(user.telegram_id, user)
+        return replace(user)
 
     async def _execute(self, query: str, params: Iterable[Any] | None = None) -> None:
-        async with self._locked_connection() as conn:
-            conn.execute(query, tuple(params) if params else ())
-            conn.commit()
+        args = tuple(params) if params else ()
+        await self._write(lambda conn: conn.execute(query, args))
 
     async def _fetchone(self, query: str, params: Iterable[Any] | None = None) -> Optional[tuple[Any, ...]]:
-        async with self._locked_connection() as conn:
-            cursor = conn.execute(query, tuple(params) if params else ())
-            row = cursor.fetchone()
-            return row
+        args = tuple(params) if params else ()
+        async with self._read_connection() as conn:
+            return conn.execute(query, args).fetchone()
 
     async def _fetchall(self, query: str, params: Iterable[Any] | None = None) -> list[tuple[Any, ...]]:
-        async with self._locked_connection() as conn:
-            cursor = conn.execute(query, tuple(params) if params else ())
-            rows = cursor.fetchall()
-            return rows
+        args = tuple(params) if params else ()
+        async with self._read_connection() as conn:
+            return await asyncio.to_thread(lambda: conn.execute(query, args).fetchall())
+
+    async def _executescript(self, script: str) -> None:
+        def run(conn: sqlite3.Connection) -> None:
+            try:
+                conn.executescript(f"BEGIN;\n{script}\nCOMMIT;")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
 
-    async def _ensure_column(self, table: str, column: str, definition: str) -> None:
-        columns = await self._fetchall(f"PRAGMA table_info({table})")
-        if not any(row[1] == column for row in columns):
-            await self._execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        await self._write(run)
+
+    async def _write(
+        self, fn: Callable[[sqlite3.Connection], T], transaction: bool = False
+    ) -> T:
+        async with self._locked_connection() as conn:
+            loop = asyncio.get_running_loop()
+            if transaction:
+                return await loop.run_in_executor(self._writer, _run_in_transaction, conn, fn)
+            return await loop.run_in_executor(self._writer, fn, conn)
+
+    async def _column_migrations(
+        self, table: str, columns: Iterable[tuple[str, str]]
+    ) -> str:
+        existing = {row[1] for row in await self._fetchall(f"PRAGMA table_info({table})")}
+        return "".join(
+            f"ALTER TABLE {table} ADD COLUMN {column} {definition};\n"
+            for column, definition in columns
+            if column not in existing
+        )
 
     @asynccontextmanager
     async def _locked_connection(self):
-        async with self._lock:
-            connection = await asyncio.to_thread(self._connect)
-            try:
-                yield connection
-            finally:
-                await asyncio.to_thread(connection.close)
+        async with self._writer_lock:
+            yield self._get_conn()
+
+    @asynccontextmanager
+    async def _read_connection(self):
+        if self._readers is None:
+            async with self._locked_connection() as conn:
+                yield conn
+            return
+        readers = self._readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _open_readers(self, count: int) -> None:
+        if self._readers is not None:
+            return
+        readers: asyncio.Queue[sqlite3.Connection] = asyncio.Queue()
+        for _ in range(count):
+            readers.put_nowait(self._connect_reader())
+        self._readers = readers
 
     def _connect(self) -> sqlite3.Connection:
-        connection = sqlite3.connect(self._path, check_same_thread=False)
+        connection = sqlite3.connect(
+            self._path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        connection.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000;
+            PRAGMA busy_timeout=5000;
+            """
+        )
         connection.row_factory = sqlite3.Row
         return connection
 
+    def _connect_reader(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            f"{self._path.resolve().as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        connection.executescript(
+            """
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-16000;
+            PRAGMA busy_timeout=5000;
+            """
+        )
+        connection.row_factory = sqlite3.Row
+        return connection
+
+
+def _insert_user(
+    conn: sqlite3.Connection,
+    telegram_id: int,
+    initial_balance: int,
+    referred_by: Optional[int],
+    username: Optional[str],
+) -> User:
+    row = conn.execute(
+        f"""
+        INSERT INTO users (
+            telegram_id,
+            balance,
+            referred_by,
+            username,
+            start_bonus_claimed
+        )
+        VALUES (?, ?, ?, ?, ?)
+        RETURNING {_USER_COLUMNS}
+        """,
+        (
+            telegram_id,
+            initial_balance,
+            referred_by,
+            username,
+            int(initial_balance > 0),
+        ),
+    ).fetchone()
+    return User(**row)
+
+
+def _run_in_transaction(conn: sqlite3.Connection, fn: Callable[[sqlite3.Connection], T]) -> T:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return result
+
 
 db = Database()
@@ -1,30 +1,75 @@
 from __future__ import annotations
 
-import datetime
+import asyncio
+import logging
+import re
+import secrets
+import time
 from contextlib import suppress
-from typing import Optional
+from typing import Any, Awaitable, Callable, Coroutine, Optional
 
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ChatMemberStatus, ChatType
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
 from aiogram.types import CallbackQuery, Message
 
+from .cache import TTLCache
 from .config import Settings
-from .database import User, db
+from .database import User, WithdrawalRequest, db
 from .keyboards import (
+    BanCallback,
+    SupportReplyCallback,
+    WithdrawalCallback,
     admin_menu_keyboard,
     main_menu_keyboard,
     subscribe_keyboard,
     support_admin_keyboard,
     withdrawal_actions_keyboard,
+    withdrawal_status_keyboard,
 )
-from .middlewares import mask_sensitive
+from .middlewares import checked_memberships, mask_sensitive
 
 router = Router()
 
+_REF_RE = re.compile(r"ref(\d{1,19})", re.ASCII)
+_DAILY_BONUS_COOLDOWN = 24 * 60 * 60
+_MEMBER_CACHE_TTL = 60
+_NON_MEMBER_CACHE_TTL = 10
+_BROADCAST_CONCURRENCY = 25
+_BROADCAST_QUEUE_SIZE = 500
+_PIN_BYTES = 3
+_CANCEL_WORDS = frozenset(("/cancel", "отмена"))
+_MAX_SQLITE_INT = 2**63 - 1
+
+_BALANCE_TMPL = "На вашем балансе %d ⭐"
+_DAILY_BONUS_TMPL = "Вы получили %d ⭐ ежедневного бонуса!"
+_DAILY_BONUS_WAIT_TMPL = "Следующий бонус будет доступен через %d ч %d мин."
+_PERSONAL_LINK_TMPL = "Ваша персональная ссылка: %s"
+_REFERRAL_LINK_TMPL = "Поделитесь этой ссылкой: %s"
+
+_member_cache: TTLCache[int, bool] = TTLCache(maxsize=10_000, ttl=_MEMBER_CACHE_TTL)
+_background_tasks: set[asyncio.Task[Any]] = set()
+
+MenuHandler = Callable[[Message, Settings, Bot, FSMContext], Awaitable[None]]
+
+_MENU_HANDLERS: dict[str, MenuHandler] = {}
+
+
+def menu_button(text: str) -> Callable[[MenuHandler], MenuHandler]:
+    def decorator(handler: MenuHandler) -> MenuHandler:
+        _MENU_HANDLERS[text] = handler
+        return handler
+
+    return decorator
+
 
 class WithdrawStates(StatesGroup):
     waiting_for_amount = State()
@@ -48,24 +93,7 @@ async def _ensure_user_record(
     username: Optional[str],
     referred_by: Optional[int] = None,
 ) -> tuple[User, bool]:
-    user = await db.get_user(telegram_id)
-    created = False
-    if user is None:
-        await db.create_user(telegram_id, 0, referred_by, username)
-        user = await db.get_user(telegram_id)
-        created = True
-    elif referred_by and user.referred_by is None and referred_by != telegram_id:
-        await db.assign_referrer(telegram_id, referred_by)
-        user.referred_by = referred_by
-
-    if user is None:
-        raise RuntimeError("Failed to ensure user record")
-
-    if user.username != username:
-        await db.update_username(telegram_id, username)
-        user.username = username
-
-    return user, created
+    return await db.upsert_and_get_user(telegram_id, 0, referred_by, username)
 
 
 async def ensure_user(message: Message, settings: Settings) -> User:
@@ -86,6 +114,41 @@ async def ensure_not_banned(message: Message, user: User) -> bool:
     return True
 
 
+async def _referral_link(bot: Bot, telegram_id: int) -> str:
+    bot_info = await bot.me()
+    return f"https://t.me/{bot_info.username}?start=ref{telegram_id}"
+
+
+def _spawn(coro: Coroutine[Any, Any, Any]) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _try_send_message(bot: Bot, chat_id: int, text: str, **kwargs: Any) -> bool:
+    try:
+        await bot.send_message(chat_id, text, **kwargs)
+    except (TelegramBadRequest, TelegramForbiddenError):
+        return False
+    return True
+
+
+async def _send_copy(message: Message, chat_id: int) -> bool:
+    return await _call_with_retry(lambda: message.send_copy(chat_id))
+
+
+async def _call_with_retry(call: Callable[[], Awaitable[Any]]) -> bool:
+    while True:
+        try:
+            await call()
+        except TelegramRetryAfter as error:
+            await asyncio.sleep(error.retry_after)
+        except TelegramAPIError:
+            return False
+        else:
+            return True
+
+
 async def _update_admin_controls(
     callback: CallbackQuery, user_id: int, is_banned: bool, request_id: Optional[int]
 ) -> None:
@@ -105,12 +168,32 @@ async def _update_admin_controls(
 
 
 async def _is_channel_member(bot: Bot, settings: Settings, telegram_id: int) -> bool:
+    checked = checked_memberships.get()
+    if checked is not None and telegram_id in checked:
+        return checked[telegram_id]
+    cached = _member_cache.get(telegram_id)
+    if cached is None:
+        cached = await _fetch_channel_membership(bot, settings, telegram_id)
+    if checked is not None:
+        checked[telegram_id] = cached
+    return cached
+
+
+async def _fetch_channel_membership(
+    bot: Bot, settings: Settings, telegram_id: int
+) -> bool:
     member = await bot.get_chat_member(settings.channel_username, telegram_id)
-    return member.status in {
+    is_member = member.status in {
         ChatMemberStatus.MEMBER,
         ChatMemberStatus.ADMINISTRATOR,
         ChatMemberStatus.CREATOR,
     }
+    _member_cache.set(
+        telegram_id,
+        is_member,
+        None if is_member else _NON_MEMBER_CACHE_TTL,
+    )
+    return is_member
 
 
 async def _activate_subscription(
@@ -118,6 +201,7 @@ async def _activate_subscription(
 ) -> bool:
     await db.set_subscription(user.telegram_id, True)
     user.is_subscribed = True
+    _member_cache.pop(user.telegram_id)
     start_bonus_awarded = False
     if not user.start_bonus_claimed:
         await db.update_balance(user.telegram_id, settings.start_bonus)
@@ -130,14 +214,16 @@ async def _activate_subscription(
         user.reward_claimed = True
 
         referral_name = f"@{user.username}" if user.username else f"ID {user.telegram_id}"
-        with suppress(TelegramBadRequest):
-            await bot.send_message(
+        _spawn(
+            _try_send_message(
+                bot,
                 user.referred_by,
                 (
                     f"Ваш реферал {referral_name} подтвердил подписку. "
                     f"Вам начислено {settings.referral_bonus} ⭐."
                 ),
             )
+        )
 
     return start_bonus_awarded
 
@@ -153,22 +239,24 @@ async def _handle_unsubscription(user: User, bot: Bot, settings: Settings) -> No
         user.reward_claimed = False
 
         referral_name = f"@{user.username}" if user.username else f"ID {user.telegram_id}"
-        with suppress(TelegramBadRequest):
-            await bot.send_message(
+        await asyncio.gather(
+            _try_send_message(
+                bot,
                 user.referred_by,
                 (
                     f"Ваш реферал {referral_name} отписался от канала. "
                     f"С вашего баланса списано {settings.referral_bonus} ⭐."
                 ),
-            )
-        with suppress(TelegramBadRequest):
-            await bot.send_message(
+            ),
+            _try_send_message(
+                bot,
                 user.telegram_id,
                 (
                     "Мы заметили, что вы отписались от канала. "
                     f"{settings.referral_bonus} ⭐ были списаны с вашего баланса и с баланса пригласившего вас пользователя."
                 ),
-            )
+            ),
+        )
 
 
 async def _verify_and_activate_subscription(
@@ -186,8 +274,12 @@ async def _verify_and_activate_subscription(
 
 
 async def ensure_subscription_access(
-    message: Message, bot: Bot, settings: Settings, user: User
+    message: Message, bot: Bot, settings: Settings, user: User, live: bool = False
 ) -> bool:
+    if live:
+        _member_cache.pop(user.telegram_id)
+    elif user.is_subscribed:
+        return True
     is_member, activated, start_bonus_awarded = await _verify_and_activate_subscription(
         bot, settings, user
     )
@@ -205,15 +297,30 @@ async def ensure_subscription_access(
     return True
 
 
+async def reverify_subscriptions(
+    bot: Bot,
+    settings: Settings,
+    batch_size: int = 20,
+    interval: float = 60,
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for user in await db.sample_subscribed_users(batch_size):
+                with suppress(TelegramAPIError):
+                    await _verify_and_activate_subscription(bot, settings, user)
+        except Exception:
+            logging.exception("Subscription re-verification failed")
+
+
 @router.message(Command("start"))
 async def cmd_start(message: Message, command: CommandObject, bot: Bot, settings: Settings) -> None:
     telegram_id = message.from_user.id
     args = command.args or ""
-    referred_by: Optional[int] = None
-    if args.startswith("ref") and args[3:].isdigit():
-        referred_by = int(args[3:])
-        if referred_by == telegram_id:
-            referred_by = None
+    match = _REF_RE.fullmatch(args)
+    referred_by = int(match.group(1)) if match else None
+    if referred_by == telegram_id or (referred_by or 0) > _MAX_SQLITE_INT:
+        referred_by = None
 
     user, created = await _ensure_user_record(
         telegram_id,
@@ -252,71 +359,68 @@ async def cmd_start(message: Message, command: CommandObject, bot: Bot, settings
             message_text += f" Вам начислено {settings.start_bonus} ⭐ стартового бонуса."
         await message.answer(message_text)
 
-    bot_info = await bot.get_me()
-    await message.answer(
-        "Ваша персональная ссылка: https://t.me/{username}?start=ref{tg_id}".format(
-            username=bot_info.username,
-            tg_id=telegram_id,
-        )
-    )
+    await message.answer(_PERSONAL_LINK_TMPL % await _referral_link(bot, telegram_id))
 
 
-@router.message(F.text == "💰 Баланс")
-async def show_balance(message: Message, settings: Settings, bot: Bot) -> None:
+@router.message(F.text.in_(_MENU_HANDLERS))
+async def menu_dispatch(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
+    await state.clear()
+    await _MENU_HANDLERS[message.text](message, settings, bot, state)
+
+
+@menu_button("💰 Баланс")
+async def show_balance(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
     user = await ensure_user(message, settings)
     if not await ensure_not_banned(message, user):
         return
     if not await ensure_subscription_access(message, bot, settings, user):
         return
-    await message.answer(f"На вашем балансе {user.balance} ⭐")
+    await message.answer(_BALANCE_TMPL % user.balance)
 
 
-@router.message(F.text == "🎁 Ежедневный бонус")
-async def daily_bonus(message: Message, settings: Settings, bot: Bot) -> None:
+@menu_button("🎁 Ежедневный бонус")
+async def daily_bonus(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
     user = await ensure_user(message, settings)
     if not await ensure_not_banned(message, user):
         return
     if not await ensure_subscription_access(message, bot, settings, user):
         return
-    now = datetime.datetime.utcnow()
-    last_bonus = None
-    if user.last_daily_bonus:
-        last_bonus = datetime.datetime.fromisoformat(user.last_daily_bonus)
-
-    if last_bonus and (now - last_bonus) < datetime.timedelta(hours=24):
-        remaining = datetime.timedelta(hours=24) - (now - last_bonus)
-        hours, remainder = divmod(int(remaining.total_seconds()), 3600)
+    now = int(time.time())
+    last_bonus = user.last_daily_bonus_ts
+    if last_bonus and now - last_bonus < _DAILY_BONUS_COOLDOWN:
+        remaining = _DAILY_BONUS_COOLDOWN - (now - last_bonus)
+        hours, remainder = divmod(remaining, 3600)
         minutes = remainder // 60
-        await message.answer(
-            f"Следующий бонус будет доступен через {hours} ч {minutes} мин."
-        )
+        await message.answer(_DAILY_BONUS_WAIT_TMPL % (hours, minutes))
         return
 
     await db.update_balance(user.telegram_id, settings.daily_bonus)
-    await db.set_last_daily_bonus(user.telegram_id, now.isoformat())
-    await message.answer(
-        f"Вы получили {settings.daily_bonus} ⭐ ежедневного бонуса!"
-    )
+    await db.set_last_daily_bonus(user.telegram_id, now)
+    await message.answer(_DAILY_BONUS_TMPL % settings.daily_bonus)
 
 
-@router.message(F.text == "👥 Реферальная ссылка")
-async def referral_link(message: Message, bot: Bot, settings: Settings) -> None:
+@menu_button("👥 Реферальная ссылка")
+async def referral_link(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
     user = await ensure_user(message, settings)
     if not await ensure_not_banned(message, user):
         return
     if not await ensure_subscription_access(message, bot, settings, user):
         return
-    bot_info = await bot.get_me()
-    await message.answer(
-        "Поделитесь этой ссылкой: https://t.me/{username}?start=ref{tg_id}".format(
-            username=bot_info.username,
-            tg_id=user.telegram_id,
-        )
-    )
+    await message.answer(_REFERRAL_LINK_TMPL % await _referral_link(bot, user.telegram_id))
 
 
-@router.message(F.text == "🏆 Топ приглашений")
-async def top_referrers(message: Message, settings: Settings, bot: Bot) -> None:
+@menu_button("🏆 Топ приглашений")
+async def top_referrers(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
     user = await ensure_user(message, settings)
     if not await ensure_not_banned(message, user):
         return
@@ -333,11 +437,14 @@ async def top_referrers(message: Message, settings: Settings, bot: Bot) -> None:
     await message.answer("\n".join(lines))
 
 
-@router.message(F.text == "✅ Проверить подписку")
-async def check_subscription(message: Message, bot: Bot, settings: Settings) -> None:
+@menu_button("✅ Проверить подписку")
+async def check_subscription(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
     user = await ensure_user(message, settings)
     if not await ensure_not_banned(message, user):
         return
+    _member_cache.pop(user.telegram_id)
     is_member, activated, start_bonus_awarded = await _verify_and_activate_subscription(
         bot, settings, user
     )
@@ -375,6 +482,7 @@ async def check_subscription_callback(
                 "Ваш аккаунт заблокирован. Свяжитесь с поддержкой для разблокировки."
             )
         return
+    _member_cache.pop(user.telegram_id)
     is_member, activated, start_bonus_awarded = await _verify_and_activate_subscription(
         bot, settings, user
     )
@@ -402,12 +510,14 @@ async def check_subscription_callback(
     await callback.answer("Готово!")
 
 
-@router.message(F.text == "💳 Вывод средств")
-async def withdrawal_request(message: Message, settings: Settings, bot: Bot, state: FSMContext) -> None:
+@menu_button("💳 Вывод средств")
+async def withdrawal_request(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
     user = await ensure_user(message, settings)
     if not await ensure_not_banned(message, user):
         return
-    if not await ensure_subscription_access(message, bot, settings, user):
+    if not await ensure_subscription_access(message, bot, settings, user, live=True):
         return
     referrals = await db.list_referrals(user.telegram_id)
     if referrals:
@@ -438,18 +548,23 @@ async def withdrawal_request(message: Message, settings: Settings, bot: Bot, sta
 async def process_withdraw_amount(
     message: Message, settings: Settings, bot: Bot, state: FSMContext
 ) -> None:
-    user = await ensure_user(message, settings)
-    if not await ensure_not_banned(message, user):
-        await state.clear()
-        return
-    if not await ensure_subscription_access(message, bot, settings, user):
-        await state.clear()
-        return
-    try:
-        amount = int(message.text)
-    except (TypeError, ValueError):
+    is_banned, is_subscribed = await db.get_access_flags(message.from_user.id) or (
+        False,
+        False,
+    )
+    if is_banned or not is_subscribed:
+        user = await ensure_user(message, settings)
+        if not await ensure_not_banned(message, user):
+            await state.clear()
+            return
+        if not await ensure_subscription_access(message, bot, settings, user):
+            await state.clear()
+            return
+    raw_amount = (message.text or "").strip()
+    if not raw_amount.isdecimal():
         await message.answer("Введите целое число.")
         return
+    amount = int(raw_amount)
 
     if amount < settings.min_withdrawal:
         await message.answer(
@@ -457,23 +572,25 @@ async def process_withdraw_amount(
         )
         return
 
-    if amount > user.balance:
+    if amount > _MAX_SQLITE_INT or not await db.create_withdrawal(
+        message.from_user.id, amount
+    ):
         await message.answer("Недостаточно средств для вывода.")
         return
 
-    await db.update_balance(user.telegram_id, -amount)
-    await db.add_withdrawal(user.telegram_id, amount)
     await state.clear()
     await message.answer(
         "Заявка на вывод создана. Администратор свяжется с вами в ближайшее время."
     )
 
 
-@router.message(F.text == "🆘 Поддержка")
-async def support_entry(message: Message, settings: Settings, state: FSMContext) -> None:
-    await ensure_user(message, settings)
-    await state.clear()
+@menu_button("🆘 Поддержка")
+async def support_entry(
+    message: Message, settings: Settings, bot: Bot, state: FSMContext
+) -> None:
+    user = await ensure_user(message, settings)
     await state.set_state(SupportStates.waiting_for_message)
+    await state.update_data(username=user.username)
     await message.answer(
         "Опишите вашу проблему одним сообщением. Для отмены отправьте /cancel или 'отмена'."
     )
@@ -483,41 +600,45 @@ async def support_entry(message: Message, settings: Settings, state: FSMContext)
 async def support_message(
     message: Message, settings: Settings, state: FSMContext, bot: Bot
 ) -> None:
-    user = await ensure_user(message, settings)
     text = message.text or message.caption or ""
-    if text.strip().lower() in {"/cancel", "отмена"}:
+    stripped = text.strip()
+    if stripped.lower() in _CANCEL_WORDS:
         await state.clear()
         await message.answer("Обращение отменено.")
         return
 
-    if not text.strip():
+    if not stripped:
         await message.answer("Пожалуйста, отправьте текстовое сообщение.")
         return
 
+    data = await state.get_data()
     await state.clear()
+    telegram_id = message.from_user.id
+    flags = await db.get_access_flags(telegram_id) if "username" in data else None
+    if flags is None:
+        user = await ensure_user(message, settings)
+        username, is_banned = user.username, bool(user.is_banned)
+    else:
+        username, (is_banned, _) = data["username"], flags
 
-    display = f"@{user.username}" if user.username else f"ID {user.telegram_id}"
-    status_line = "заблокирован" if user.is_banned else "активен"
+    display = f"@{username}" if username else f"ID {telegram_id}"
+    status_line = "заблокирован" if is_banned else "активен"
     support_text = (
         "Новое обращение в поддержку\n"
-        f"От: {display} (ID {user.telegram_id})\n"
+        f"От: {display} (ID {telegram_id})\n"
         f"Статус: {status_line}\n\n"
         f"{text}"
     )
 
-    notified = False
-    for admin_id in settings.admin_ids:
-        try:
-            await bot.send_message(
-                admin_id,
-                support_text,
-                reply_markup=support_admin_keyboard(user.telegram_id, user.is_banned),
-            )
-            notified = True
-        except (TelegramBadRequest, TelegramForbiddenError):
-            continue
+    keyboard = support_admin_keyboard(telegram_id, is_banned)
+    results = await asyncio.gather(
+        *(
+            _try_send_message(bot, admin_id, support_text, reply_markup=keyboard)
+            for admin_id in settings.admin_ids
+        )
+    )
 
-    if notified:
+    if any(results):
         await message.answer(
             "Ваше обращение отправлено администрации. Ожидайте ответа в этом чате."
         )
@@ -527,16 +648,18 @@ async def support_message(
         )
 
 
-@router.callback_query(F.data.startswith("support_reply"))
+@router.callback_query(SupportReplyCallback.filter())
 async def support_reply_start(
-    callback: CallbackQuery, settings: Settings, state: FSMContext
+    callback: CallbackQuery,
+    callback_data: SupportReplyCallback,
+    settings: Settings,
+    state: FSMContext,
 ) -> None:
     if callback.from_user.id not in settings.admin_ids:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
 
-    _, user_id_raw = callback.data.split(":", 1)
-    target_id = int(user_id_raw)
+    target_id = callback_data.user_id
     await state.clear()
     await state.set_state(AdminReplyStates.waiting_for_reply)
     await state.update_data(reply_target=target_id)
@@ -559,7 +682,8 @@ async def support_reply_send(
         return
 
     text = message.text or message.caption or ""
-    if text.strip().lower() in {"/cancel", "отмена"}:
+    stripped = text.strip()
+    if stripped.lower() in _CANCEL_WORDS:
         await state.clear()
         await message.answer("Ответ отменен.", reply_markup=admin_menu_keyboard())
         return
@@ -574,7 +698,7 @@ async def support_reply_send(
         )
         return
 
-    if not text.strip():
+    if not stripped:
         await message.answer("Пожалуйста, отправьте текст ответа или /cancel.")
         return
 
@@ -607,64 +731,54 @@ async def support_reply_send(
         await state.clear()
 
 
-def _parse_target_payload(payload: str) -> tuple[int, Optional[int]]:
-    parts = payload.split(":")
-    user_id = int(parts[1])
-    request_id: Optional[int] = None
-    if len(parts) > 2 and parts[2].isdigit():
-        request_id = int(parts[2])
-    return user_id, request_id
-
-
 async def _set_ban_status(
     bot: Bot, user_id: int, banned: bool
 ) -> Optional[User]:
-    user = await db.get_user(user_id)
-    if user is None:
-        return None
-    if user.is_banned == banned:
+    user, changed = await db.set_ban_status_returning(user_id, banned)
+    if user is None or not changed:
         return user
-    await db.set_ban_status(user_id, banned)
-    user.is_banned = banned
     notify_text = (
         "Ваш аккаунт заблокирован. Свяжитесь с поддержкой, чтобы узнать подробности."
         if banned
         else "Ваш аккаунт разблокирован. Вы снова можете пользоваться ботом."
     )
-    with suppress(TelegramBadRequest, TelegramForbiddenError):
-        await bot.send_message(user_id, notify_text)
+    _spawn(_try_send_message(bot, user_id, notify_text))
     return user
 
 
-@router.callback_query(F.data.startswith("block_user"))
-async def block_user_callback(callback: CallbackQuery, settings: Settings) -> None:
+@router.callback_query(BanCallback.filter(F.action == "block"))
+async def block_user_callback(
+    callback: CallbackQuery, callback_data: BanCallback, settings: Settings
+) -> None:
     if callback.from_user.id not in settings.admin_ids:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
 
-    user_id, request_id = _parse_target_payload(callback.data)
+    user_id = callback_data.user_id
     user = await _set_ban_status(callback.bot, user_id, True)
     if user is None:
         await callback.answer("Пользователь не найден", show_alert=True)
         return
 
-    await _update_admin_controls(callback, user_id, True, request_id)
+    await _update_admin_controls(callback, user_id, True, callback_data.request_id)
     await callback.answer("Пользователь заблокирован")
 
 
-@router.callback_query(F.data.startswith("unblock_user"))
-async def unblock_user_callback(callback: CallbackQuery, settings: Settings) -> None:
+@router.callback_query(BanCallback.filter(F.action == "unblock"))
+async def unblock_user_callback(
+    callback: CallbackQuery, callback_data: BanCallback, settings: Settings
+) -> None:
     if callback.from_user.id not in settings.admin_ids:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
 
-    user_id, request_id = _parse_target_payload(callback.data)
+    user_id = callback_data.user_id
     user = await _set_ban_status(callback.bot, user_id, False)
     if user is None:
         await callback.answer("Пользователь не найден", show_alert=True)
         return
 
-    await _update_admin_controls(callback, user_id, False, request_id)
+    await _update_admin_controls(callback, user_id, False, callback_data.request_id)
     await callback.answer("Пользователь разблокирован")
 
 
@@ -693,54 +807,61 @@ async def admin_stats(callback: CallbackQuery, settings: Settings) -> None:
     await callback.answer()
 
 
+def _format_withdrawal_request(
+    request: WithdrawalRequest,
+    user: Optional[User],
+    referrals: list[tuple[int, Optional[str]]],
+) -> str:
+    if user and user.username:
+        user_line = f"@{user.username} (ID {user.telegram_id})"
+    else:
+        user_line = f"ID {request.telegram_id}"
+
+    if referrals:
+        referrals_lines = "\n".join(
+            f"• @{username}" if username else f"• ID {ref_id}"
+            for ref_id, username in referrals
+        )
+        referrals_block = f"\nПриглашенные друзья:\n{referrals_lines}"
+    else:
+        referrals_block = "\nПриглашенные друзья: нет"
+
+    status_line = "Заблокирован" if (user and user.is_banned) else "Активен"
+
+    return (
+        f"Заявка #{request.id}\n"
+        f"Пользователь: {user_line}\n"
+        f"Сумма: {request.amount} ⭐\n"
+        f"Создана: {request.created_at}\n"
+        f"Статус пользователя: {status_line}{referrals_block}"
+    )
+
+
 @router.callback_query(F.data == "admin_withdrawals")
 async def admin_withdrawals(callback: CallbackQuery, settings: Settings) -> None:
     if callback.from_user.id not in settings.admin_ids:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    requests = await db.list_withdrawals(status="pending")
+    requests = await db.list_pending_withdrawals_with_context()
     if not requests:
         await callback.answer("Нет ожидающих заявок", show_alert=True)
         return
-    for request in requests:
-        user = await db.get_user(request.telegram_id)
-        if user and user.username:
-            user_line = f"@{user.username} (ID {user.telegram_id})"
-        else:
-            user_line = f"ID {request.telegram_id}"
-
-        referrals = await db.list_referrals(request.telegram_id)
-        if referrals:
-            referrals_lines = "\n".join(
-                f"• @{username}" if username else f"• ID {ref_id}"
-                for ref_id, username in referrals
-            )
-            referrals_block = f"\nПриглашенные друзья:\n{referrals_lines}"
-        else:
-            referrals_block = "\nПриглашенные друзья: нет"
-
-        status_line = "Заблокирован" if (user and user.is_banned) else "Активен"
-
-        await callback.message.answer(
-            (
-                f"Заявка #{request.id}\n"
-                f"Пользователь: {user_line}\n"
-                f"Сумма: {request.amount} ⭐\n"
-                f"Создана: {request.created_at}\n"
-                f"Статус пользователя: {status_line}{referrals_block}"
-            ),
-            reply_markup=withdrawal_actions_keyboard(
-                request.id,
-                request.telegram_id,
-                bool(user and user.is_banned),
-            ),
+    for request, user, referrals in requests:
+        text = _format_withdrawal_request(request, user, referrals)
+        keyboard = withdrawal_actions_keyboard(
+            request.id,
+            request.telegram_id,
+            bool(user and user.is_banned),
+        )
+        await _call_with_retry(
+            lambda: callback.message.answer(text, reply_markup=keyboard)
         )
     await callback.answer()
 
 
-async def _update_withdrawal_status(callback: CallbackQuery, status: str, bot: Bot) -> None:
-    _, raw_id = callback.data.split(":", 1)
-    request_id = int(raw_id)
+async def _update_withdrawal_status(
+    callback: CallbackQuery, request_id: int, status: str, bot: Bot
+) -> None:
     request = await db.get_withdrawal(request_id)
     if request is None:
         await callback.answer("Заявка не найдена", show_alert=True)
@@ -754,8 +875,8 @@ async def _update_withdrawal_status(callback: CallbackQuery, status: str, bot: B
     }.get(status, status)
 
     try:
-        await callback.message.edit_text(
-            callback.message.text + f"\nСтатус обновлен: {status_label}",
+        await callback.message.edit_reply_markup(
+            reply_markup=withdrawal_status_keyboard(request_id, status_label)
         )
     except TelegramBadRequest:
         pass
@@ -777,20 +898,31 @@ async def _update_withdrawal_status(callback: CallbackQuery, status: str, bot: B
     await callback.answer("Статус обновлен")
 
 
-@router.callback_query(F.data.startswith("withdraw_paid"))
-async def withdrawal_paid(callback: CallbackQuery, settings: Settings) -> None:
+@router.callback_query(WithdrawalCallback.filter(F.action == "paid"))
+async def withdrawal_paid(
+    callback: CallbackQuery, callback_data: WithdrawalCallback, settings: Settings
+) -> None:
     if callback.from_user.id not in settings.admin_ids:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    await _update_withdrawal_status(callback, "paid", callback.bot)
+    await _update_withdrawal_status(callback, callback_data.request_id, "paid", callback.bot)
 
 
-@router.callback_query(F.data.startswith("withdraw_rejected"))
-async def withdrawal_rejected(callback: CallbackQuery, settings: Settings) -> None:
+@router.callback_query(WithdrawalCallback.filter(F.action == "rejected"))
+async def withdrawal_rejected(
+    callback: CallbackQuery, callback_data: WithdrawalCallback, settings: Settings
+) -> None:
     if callback.from_user.id not in settings.admin_ids:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
-    await _update_withdrawal_status(callback, "rejected", callback.bot)
+    await _update_withdrawal_status(callback, callback_data.request_id, "rejected", callback.bot)
+
+
+@router.callback_query(WithdrawalCallback.filter(F.action == "status"))
+async def withdrawal_status(
+    callback: CallbackQuery, callback_data: WithdrawalCallback
+) -> None:
+    await callback.answer(f"Заявка #{callback_data.request_id} уже обработана")
 
 
 @router.callback_query(F.data == "admin_broadcast")
@@ -823,19 +955,33 @@ async def admin_broadcast_send(
         return
 
     text = message.text or ""
-    if text.strip().lower() in {"/cancel", "отмена"}:
+    if text.strip().lower() in _CANCEL_WORDS:
         await state.clear()
         await message.answer("Рассылка отменена.", reply_markup=admin_menu_keyboard())
         return
 
-    users = await db.list_all_users()
+    queue: asyncio.Queue[int] = asyncio.Queue(maxsize=_BROADCAST_QUEUE_SIZE)
     sent = 0
-    for user in users:
-        try:
-            await message.send_copy(user.telegram_id)
-            sent += 1
-        except (TelegramBadRequest, TelegramForbiddenError):
-            continue
+
+    async def worker() -> None:
+        nonlocal sent
+        while True:
+            chat_id = await queue.get()
+            try:
+                if await _send_copy(message, chat_id):
+                    sent += 1
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(_BROADCAST_CONCURRENCY)]
+    try:
+        async for user in db.iter_all_users():
+            await queue.put(user.telegram_id)
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
 
     await state.clear()
     await message.answer(
@@ -846,9 +992,7 @@ async def admin_broadcast_send(
 
 @router.callback_query(F.data == "admin_regen_pin")
 async def regen_pin(callback: CallbackQuery, settings: Settings) -> None:
-    import secrets
-
-    new_pin = secrets.token_hex(3)
+    new_pin = secrets.token_hex(_PIN_BYTES)
     await callback.answer(f"Новый защитный PIN: {new_pin}", show_alert=True)
     await callback.message.edit_text(
         "PIN обновлен. Передайте его только проверенным модераторам.",
@@ -1,18 +1,50 @@
+from functools import lru_cache
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 
 
+class WithdrawalCallback(CallbackData, prefix="withdraw"):
+    action: str
+    request_id: int
+
+
+class BanCallback(CallbackData, prefix="ban"):
+    action: str
+    user_id: int
+    request_id: Optional[int] = None
+
+
+class SupportReplyCallback(CallbackData, prefix="support_reply"):
+    user_id: int
+
+
+_MAIN_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="💰 Баланс"), KeyboardButton(text="🎁 Ежедневный бонус")],
+        [KeyboardButton(text="👥 Реферальная ссылка"), KeyboardButton(text="🏆 Топ приглашений")],
+        [KeyboardButton(text="💳 Вывод средств"), KeyboardButton(text="✅ Проверить подписку")],
+        [KeyboardButton(text="🆘 Поддержка")],
+    ],
+    resize_keyboard=True,
+)
+
+_ADMIN_MENU = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="📜 Запросы на вывод", callback_data="admin_withdrawals")],
+        [InlineKeyboardButton(text="📣 Рассылка", callback_data="admin_broadcast")],
+        [InlineKeyboardButton(text="🔐 Перегенерировать защитный PIN", callback_data="admin_regen_pin")],
+    ]
+)
+
+
 def main_menu_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="💰 Баланс"), KeyboardButton(text="🎁 Ежедневный бонус")],
-            [KeyboardButton(text="👥 Реферальная ссылка"), KeyboardButton(text="🏆 Топ приглашений")],
-            [KeyboardButton(text="💳 Вывод средств"), KeyboardButton(text="✅ Проверить подписку")],
-            [KeyboardButton(text="🆘 Поддержка")],
-        ],
-        resize_keyboard=True,
-    )
+    return _MAIN_MENU
 
 
+@lru_cache(maxsize=1)
 def subscribe_keyboard(channel_username: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -23,14 +55,7 @@ def subscribe_keyboard(channel_username: str) -> InlineKeyboardMarkup:
 
 
 def admin_menu_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
-            [InlineKeyboardButton(text="📜 Запросы на вывод", callback_data="admin_withdrawals")],
-            [InlineKeyboardButton(text="📣 Рассылка", callback_data="admin_broadcast")],
-            [InlineKeyboardButton(text="🔐 Перегенерировать защитный PIN", callback_data="admin_regen_pin")],
-        ]
-    )
+    return _ADMIN_MENU
 
 
 def withdrawal_actions_keyboard(
@@ -41,33 +66,57 @@ def withdrawal_actions_keyboard(
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Выплачено", callback_data=f"withdraw_paid:{request_id}"),
-                InlineKeyboardButton(text="❌ Отклонено", callback_data=f"withdraw_rejected:{request_id}"),
+                InlineKeyboardButton(
+                    text="✅ Выплачено",
+                    callback_data=WithdrawalCallback(action="paid", request_id=request_id).pack(),
+                ),
+                InlineKeyboardButton(
+                    text="❌ Отклонено",
+                    callback_data=WithdrawalCallback(action="rejected", request_id=request_id).pack(),
+                ),
             ],
             [
                 InlineKeyboardButton(
                     text="🚫 Разблокировать" if is_banned else "🚫 Заблокировать",
-                    callback_data=(
-                        f"unblock_user:{user_id}:{request_id}"
-                        if is_banned
-                        else f"block_user:{user_id}:{request_id}"
-                    ),
+                    callback_data=BanCallback(
+                        action="unblock" if is_banned else "block",
+                        user_id=user_id,
+                        request_id=request_id,
+                    ).pack(),
                 )
             ],
         ]
     )
 
 
+def withdrawal_status_keyboard(request_id: int, status_label: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=f"Статус: {status_label}",
+                    callback_data=WithdrawalCallback(action="status", request_id=request_id).pack(),
+                )
+            ]
+        ]
+    )
+
+
 def support_admin_keyboard(user_id: int, is_banned: bool) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="💬 Ответить", callback_data=f"support_reply:{user_id}")],
+            [
+                InlineKeyboardButton(
+                    text="💬 Ответить",
+                    callback_data=SupportReplyCallback(user_id=user_id).pack(),
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text="🚫 Разблокировать" if is_banned else "🚫 Заблокировать",
-                    callback_data=(
-                        f"unblock_user:{user_id}" if is_banned else f"block_user:{user_id}"
-                    ),
+                    callback_data=BanCallback(
+                        action="unblock" if is_banned else "block", user_id=user_id
+                    ).pack(),
                 )
             ],
         ]
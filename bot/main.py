@@ -1,25 +1,31 @@
 import asyncio
 import logging
+from contextlib import suppress
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 from .config import Settings, load_settings
 from .database import db
-from .handlers import register_handlers
-from .middlewares import ThrottlingMiddleware
+from .handlers import register_handlers, reverify_subscriptions
+from .middlewares import MembershipScopeMiddleware, ThrottlingMiddleware
 
 
 async def on_startup(bot: Bot) -> None:
-    logging.info("Bot started as %s", (await bot.get_me()).username)
+    logging.info("Bot started as %s", (await bot.me()).username)
 
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO)
     settings: Settings = load_settings()
 
-    await db.setup()
+    await db.setup(read_connections=settings.db_read_connections)
 
     bot = Bot(
         token=settings.bot_token,
@@ -28,14 +34,24 @@ async def main() -> None:
     dp = Dispatcher()
     dp.workflow_data.update(settings=settings)
 
+    dp.update.outer_middleware(MembershipScopeMiddleware())
     dp.message.middleware(ThrottlingMiddleware(rate_limit=0.5))
 
     register_handlers(dp)
 
     dp.startup.register(on_startup)
 
-    await dp.start_polling(bot)
+    reverify_task = asyncio.create_task(reverify_subscriptions(bot, settings))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        reverify_task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await reverify_task
+        await db.close()
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(main())
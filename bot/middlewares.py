@@ -1,6 +1,7 @@
 import asyncio
 from collections import defaultdict
-from typing import Any, Callable, Dict
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
 
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
@@ -32,6 +33,25 @@ class ThrottlingMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
+checked_memberships: ContextVar[Optional[Dict[int, bool]]] = ContextVar(
+    "checked_memberships", default=None
+)
+
+
+class MembershipScopeMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = checked_memberships.set({})
+        try:
+            return await handler(event, data)
+        finally:
+            checked_memberships.reset(token)
+
+
 def mask_sensitive(text: str) -> str:
     if len(text) <= 6:
         return "*" * len(text)